@@ -1,5 +1,9 @@
-import json
+try:
+    import orjson as json  # C实现，解析更快；接口与json.loads兼容
+except ImportError:
+    import json
 import socket
+import struct
 import YB_Pcb_Car  #导入亚博智能专用的底层库文件
 import time
 
@@ -8,21 +12,61 @@ car = YB_Pcb_Car.YB_Pcb_Car()
 
 # 全局socket连接
 sock = None
+# 带缓冲的读端，一次系统调用读入尽可能多的数据
+rfile = None
+
+# 接收缓冲区大小
+RECV_BUFFER_SIZE = 1 << 20
+READ_BUFFER_SIZE = 65536
+
+# 每条消息前的4字节大端长度前缀
+LENGTH_PREFIX = struct.Struct('>I')
+# 单条消息的最大长度；超过则认为数据流不同步，重置连接
+MAX_MESSAGE_SIZE = 1 << 20
+
+# 最近一次读取的数据，在有效期内直接复用（x/y/type通常来自同一条消息）
+json_cache = {'data': None, 'ts': 0.0}
+CACHE_TTL = 0.02  # 秒
 
 def connect_to_server():
-    global sock
+    global sock, rfile
     if sock is None:
         try:
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_SIZE)
             sock.connect(('localhost', 8080))
+            # 小而频繁的请求：关闭Nagle算法并保持长连接
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            rfile = sock.makefile('rb', buffering=READ_BUFFER_SIZE)
             print("Connected to WebSocket server on port 8080")
         except Exception as e:
             print("Failed to connect to server: {}".format(e))
             sock = None
+            rfile = None
     return sock is not None
 
+def recv_exactly(n):
+    """从缓冲读端读取恰好n个字节"""
+    data = rfile.read(n)
+    if len(data) == n:
+        return data
+    chunks = [data]
+    remaining = n - len(data)
+    while remaining > 0:
+        chunk = rfile.read(remaining)
+        if not chunk:
+            raise EOFError("Connection closed while reading message")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
 def read_json():
-    global sock
+    global sock, rfile
+    now = time.monotonic()
+    if json_cache['data'] is not None and now - json_cache['ts'] < CACHE_TTL:
+        return json_cache['data']
+    
     if not connect_to_server():
         return None
     
@@ -31,17 +75,24 @@ def read_json():
         message = "get_data"
         sock.send(message.encode('utf-8'))
         
-        # 接收响应数据
-        data = sock.recv(1024)
+        # 接收响应数据（长度前缀 + JSON消息体）
+        length = LENGTH_PREFIX.unpack(recv_exactly(LENGTH_PREFIX.size))[0]
+        if length > MAX_MESSAGE_SIZE:
+            raise ValueError("Message length {} exceeds limit of {}".format(length, MAX_MESSAGE_SIZE))
+        data = recv_exactly(length)
         if data:
-            json_str = data.decode('utf-8')
-            json_data = json.loads(json_str)
+            json_data = json.loads(data)
+            json_cache['data'] = json_data
+            json_cache['ts'] = now
             return json_data
         else:
             return None
     except Exception as e:
         print("Error reading data: {}".format(e))
         # 重置连接
+        if rfile:
+            rfile.close()
+            rfile = None
         if sock:
             sock.close()
             sock = None
@@ -50,32 +101,32 @@ def read_json():
 def read_cord_x():
     json_data = read_json()
     if json_data:
-        cord_x = json_data["x"]
-        return cord_x
+        return json_data.get("x")
     return None
 
 def read_cord_y():
     json_data = read_json()
     if json_data:
-        cord_y = json_data["y"]
-        return cord_y
+        return json_data.get("y")
     return None
 
 def read_type():
     json_data = read_json()
     if json_data:
-        type = json_data["type"]
-        return type
+        return json_data.get("type")
     return None
 
 def close_connection():
-    global sock
+    global sock, rfile
     if sock:
         try:
+            if rfile:
+                rfile.close()
             sock.close()
             print("Connection closed")
         except Exception as e:
             print("Error closing connection: {}".format(e))
         finally:
             sock = None
+            rfile = None
 
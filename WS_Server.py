@@ -1,14 +1,20 @@
 import socket
+import selectors
 import threading
 import logging
 import time
 import hashlib
 import base64
 import struct
+import functools
 from datetime import datetime
 
+from ws_masking import mask_payload
+
 # WebSocket protocol constants
 WS_MAGIC_STRING = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_MAGIC_BYTES = WS_MAGIC_STRING.encode('ascii')
+_KEY_HEADER = b'\r\nsec-websocket-key:'
 WS_OPCODE_CONTINUATION = 0x0
 WS_OPCODE_TEXT = 0x1
 WS_OPCODE_BINARY = 0x2
@@ -16,7 +22,19 @@ WS_OPCODE_CLOSE = 0x8
 WS_OPCODE_PING = 0x9
 WS_OPCODE_PONG = 0xa
 
-# Python 2.7 compatible logging setup
+# Prebuilt empty pong, the server's most frequent outbound frame
+_PONG_EMPTY_FRAME = bytes([0x80 | WS_OPCODE_PONG, 0])
+
+# Event loop settings
+RECV_CHUNK_SIZE = 4096
+HANDSHAKE_MAX_SIZE = 4096
+SELECT_TIMEOUT = 1.0
+# Largest payload accepted from a client; bounds the per-client buffer
+MAX_FRAME_SIZE = 1 << 20
+# Largest backlog of unsent frames kept for a client that is not reading
+MAX_OUTBUF_SIZE = 4 << 20
+
+# Logging setup
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -35,22 +53,25 @@ client_lock = threading.Lock()
 
 def create_websocket_accept_key(websocket_key):
     """Create WebSocket accept key for handshake"""
-    accept_key = websocket_key + WS_MAGIC_STRING
-    sha1_hash = hashlib.sha1(accept_key.encode('utf-8')).digest()
-    return base64.b64encode(sha1_hash).decode('utf-8')
+    h = hashlib.sha1(websocket_key.encode('ascii'))
+    h.update(_MAGIC_BYTES)
+    return base64.b64encode(h.digest()).decode('ascii')
 
 def parse_websocket_frame(data):
-    """Parse WebSocket frame and return payload"""
+    """Parse WebSocket frame and return (opcode, payload, consumed), consumed is 0 for an incomplete frame
+
+    Raises ValueError when the announced payload is larger than MAX_FRAME_SIZE.
+    """
     if len(data) < 2:
-        return None, None
+        return None, None, 0
     
     # First byte: FIN (1 bit) + RSV (3 bits) + Opcode (4 bits)
-    first_byte = ord(data[0]) if isinstance(data[0], str) else data[0]
+    first_byte = data[0]
     fin = (first_byte >> 7) & 1
     opcode = first_byte & 0x0f
     
     # Second byte: MASK (1 bit) + Payload length (7 bits)
-    second_byte = ord(data[1]) if isinstance(data[1], str) else data[1]
+    second_byte = data[1]
     masked = (second_byte >> 7) & 1
     payload_length = second_byte & 0x7f
     
@@ -59,63 +80,61 @@ def parse_websocket_frame(data):
     # Extended payload length
     if payload_length == 126:
         if len(data) < offset + 2:
-            return None, None
+            return None, None, 0
         payload_length = struct.unpack('>H', data[offset:offset+2])[0]
         offset += 2
     elif payload_length == 127:
         if len(data) < offset + 8:
-            return None, None
+            return None, None, 0
         payload_length = struct.unpack('>Q', data[offset:offset+8])[0]
         offset += 8
     
+    # Reject oversized frames before waiting to buffer their payload
+    if payload_length > MAX_FRAME_SIZE:
+        raise ValueError("Frame payload of {0} bytes exceeds limit of {1}".format(payload_length, MAX_FRAME_SIZE))
+    
     # Masking key
     if masked:
         if len(data) < offset + 4:
-            return None, None
-        masking_key = data[offset:offset+4]
+            return None, None, 0
+        masking_key = memoryview(data)[offset:offset+4].tobytes()
         offset += 4
     else:
         masking_key = None
     
     # Payload data
     if len(data) < offset + payload_length:
-        return None, None
+        return None, None, 0
     
-    payload = data[offset:offset+payload_length]
+    payload = memoryview(data)[offset:offset+payload_length].tobytes()
     
     # Unmask payload if masked
     if masked and masking_key:
-        unmasked_payload = bytearray()
-        for i in range(len(payload)):
-            mask_byte = ord(masking_key[i % 4]) if isinstance(masking_key[i % 4], str) else masking_key[i % 4]
-            payload_byte = ord(payload[i]) if isinstance(payload[i], str) else payload[i]
-            unmasked_payload.append(payload_byte ^ mask_byte)
-        payload = bytes(unmasked_payload)
+        payload = mask_payload(payload, masking_key)
     
-    return opcode, payload
+    return opcode, payload, offset + payload_length
 
-def create_websocket_frame(opcode, payload):
-    """Create WebSocket frame for sending data"""
-    frame = bytearray()
-    
-    # First byte: FIN=1, RSV=000, Opcode
-    frame.append(0x80 | opcode)
-    
-    # Payload length
-    payload_length = len(payload)
+@functools.lru_cache(maxsize=256)
+def _header_for(opcode, payload_length):
+    """Return the header of a final, unmasked frame"""
     if payload_length < 126:
-        frame.append(payload_length)
+        return struct.pack('>BB', 0x80 | opcode, payload_length)
     elif payload_length < 65536:
-        frame.append(126)
-        frame.extend(struct.pack('>H', payload_length))
+        return struct.pack('>BBH', 0x80 | opcode, 126, payload_length)
     else:
-        frame.append(127)
-        frame.extend(struct.pack('>Q', payload_length))
+        return struct.pack('>BBQ', 0x80 | opcode, 127, payload_length)
+
+def create_websocket_frame(opcode, payload):
+    """Create WebSocket frame for sending data, returned as a bytearray"""
+    header = _header_for(opcode, len(payload))
+    header_length = len(header)
     
-    # Payload data
-    frame.extend(payload)
+    # Allocate the whole frame once; sockets accept the bytearray as is
+    frame = bytearray(header_length + len(payload))
+    frame[:header_length] = header
+    frame[header_length:] = payload
     
-    return bytes(frame)
+    return frame
 
 class WebSocketServer:
     def __init__(self, host='0.0.0.0', port=8080):
@@ -123,20 +142,24 @@ class WebSocketServer:
         self.port = port
         self.server_socket = None
         self.running = False
+        self.selector = None
+        # fd -> per-client state (socket, address, handshake flag, receive buffer)
+        self.client_states = {}
     
-    def perform_websocket_handshake(self, client_socket):
+    def perform_websocket_handshake(self, client_socket, request):
         """Perform WebSocket handshake"""
         try:
-            # Receive HTTP request
-            request = client_socket.recv(4096).decode('utf-8')
-            logger.info("Received handshake request: {0}".format(request[:200]))
+            logger.info("Received handshake request: {0}".format(request[:200].decode('utf-8', 'replace')))
             
-            # Parse WebSocket key from headers
+            # Find the WebSocket key header with a single search over the request
             websocket_key = None
-            for line in request.split('\r\n'):
-                if line.lower().startswith('sec-websocket-key:'):
-                    websocket_key = line.split(':', 1)[1].strip()
-                    break
+            idx = request.lower().find(_KEY_HEADER)
+            if idx >= 0:
+                start = idx + len(_KEY_HEADER)
+                end = request.find(b'\r\n', start)
+                if end == -1:
+                    end = len(request)
+                websocket_key = request[start:end].strip().decode('ascii')
             
             if not websocket_key:
                 logger.error("No WebSocket key found in handshake")
@@ -154,7 +177,7 @@ class WebSocketServer:
                 "\r\n"
             ).format(accept_key)
             
-            client_socket.send(response.encode('utf-8'))
+            client_socket.sendall(response.encode('utf-8'))
             logger.info("WebSocket handshake completed successfully")
             return True
             
@@ -178,89 +201,172 @@ class WebSocketServer:
             logger.info("Client disconnected: {0}".format(client_info))
             logger.info("Current connections: {0}".format(len(connected_clients)))
     
-    def send_pong(self, client_socket, payload=b''):
-        """Send pong frame in response to ping"""
-        try:
+    def send_pong(self, state, payload=b''):
+        """Send pong frame in response to ping, return False if the connection failed"""
+        if payload:
             pong_frame = create_websocket_frame(WS_OPCODE_PONG, payload)
-            client_socket.send(pong_frame)
-            logger.info("Sent pong response")
-        except Exception as e:
-            logger.error("Error sending pong: {0}".format(e))
+        else:
+            pong_frame = _PONG_EMPTY_FRAME
+        state['outbuf'] += pong_frame
+        if not self.flush_client(state):
+            return False
+        logger.info("Sent pong response")
+        return True
     
-    def handle_client(self, client_socket, client_address):
-        """Handle WebSocket client connection"""
+    def flush_client(self, state):
+        """Write queued outgoing bytes, return False if the connection failed
+
+        Whatever the non-blocking socket does not take now stays queued and
+        the client is watched for EVENT_WRITE until the queue is empty.
+        """
+        outbuf = state['outbuf']
         try:
+            while outbuf:
+                sent = state['socket'].send(outbuf)
+                del outbuf[:sent]
+        except BlockingIOError:
+            pass
+        except socket.error as e:
+            logger.error("Error sending to client: {0}".format(e))
+            return False
+        
+        if len(outbuf) > MAX_OUTBUF_SIZE:
+            logger.error("Client is not reading, {0} bytes queued".format(len(outbuf)))
+            return False
+        
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if outbuf else selectors.EVENT_READ
+        if events != state['events']:
+            self.selector.modify(state['socket'], events)
+            state['events'] = events
+        return True
+    
+    def accept_client(self):
+        """Accept a new client and register it with the selector"""
+        client_socket, client_address = self.server_socket.accept()
+        client_socket.setblocking(False)
+        fd = client_socket.fileno()
+        self.client_states[fd] = {
+            'fd': fd,
+            'socket': client_socket,
+            'address': client_address,
+            'handshake_done': False,
+            # Unconsumed bytes: the HTTP request, then partial WebSocket frames
+            'buffer': bytearray(),
+            # Outgoing bytes the socket has not accepted yet
+            'outbuf': bytearray(),
+            'events': selectors.EVENT_READ,
+        }
+        self.selector.register(client_socket, selectors.EVENT_READ)
+    
+    def close_client(self, state):
+        """Remove client from the selector and close its socket"""
+        client_socket = state['socket']
+        self.client_states.pop(state['fd'], None)
+        try:
+            self.selector.unregister(client_socket)
+        except (KeyError, ValueError):
+            pass
+        self.unregister_client(client_socket, state['address'])
+        try:
+            client_socket.close()
+        except:
+            pass
+    
+    def handle_frame(self, state, opcode, payload):
+        """Handle a single WebSocket frame, return False when the connection should close"""
+        if opcode == WS_OPCODE_TEXT:
+            # Text message - print stream message directly
+            try:
+                message = payload.decode('utf-8')
+                print("Received stream message: {0}".format(message))
+                logger.info("Stream message: {0}".format(message))
+            except UnicodeDecodeError:
+                logger.error("Failed to decode text message")
+        
+        elif opcode == WS_OPCODE_BINARY:
+            # Binary message - print as hex
+            hex_data = ' '.join('{:02x}'.format(b) for b in payload)
+            print("Received binary stream: {0}".format(hex_data))
+            logger.info("Binary stream: {0}".format(hex_data))
+        
+        elif opcode == WS_OPCODE_PING:
+            # Respond to ping with pong
+            if not self.send_pong(state, payload):
+                return False
+        
+        elif opcode == WS_OPCODE_PONG:
+            # Pong received
+            logger.info("Pong received")
+        
+        elif opcode == WS_OPCODE_CLOSE:
+            # Close connection
+            logger.info("Close frame received")
+            return False
+        
+        else:
+            logger.warning("Unknown opcode received: {0}".format(opcode))
+        
+        return True
+    
+    def handle_client(self, state):
+        """Handle readable WebSocket client connection"""
+        client_socket = state['socket']
+        client_address = state['address']
+        try:
+            # Receive data from client
+            data = client_socket.recv(RECV_CHUNK_SIZE)
+        except BlockingIOError:
+            return
+        except socket.error as e:
+            logger.info("Client connection closed: {0}".format(e))
+            self.close_client(state)
+            return
+        
+        if not data:
+            self.close_client(state)
+            return
+        
+        buf = state['buffer']
+        buf.extend(data)
+        
+        if not state['handshake_done']:
+            # Collect the HTTP request until the end of its headers
+            end = buf.find(b'\r\n\r\n')
+            if end == -1:
+                if len(buf) < HANDSHAKE_MAX_SIZE:
+                    return
+                end = len(buf)
+            else:
+                end += 4
+            
             # Perform WebSocket handshake
-            if not self.perform_websocket_handshake(client_socket):
+            if not self.perform_websocket_handshake(client_socket, bytes(buf[:end])):
                 logger.error("WebSocket handshake failed for client {0}:{1}".format(client_address[0], client_address[1]))
-                client_socket.close()
+                self.close_client(state)
                 return
             
-            # Register client after successful handshake
+            # Register client after successful handshake; frames sent right
+            # behind the request stay in the buffer
+            del buf[:end]
+            state['handshake_done'] = True
             self.register_client(client_socket, client_address)
-            
-            # Handle WebSocket frames
-            while self.running:
-                try:
-                    # Receive data from client
-                    data = client_socket.recv(4096)
-                    if not data:
-                        break
-                    
-                    # Parse WebSocket frame
-                    opcode, payload = parse_websocket_frame(data)
-                    
-                    if opcode is None:
-                        logger.warning("Invalid WebSocket frame received")
-                        continue
-                    
-                    # Handle different frame types
-                    if opcode == WS_OPCODE_TEXT:
-                        # Text message - print stream message directly
-                        try:
-                            message = payload.decode('utf-8')
-                            print("Received stream message: {0}".format(message))
-                            logger.info("Stream message: {0}".format(message))
-                        except UnicodeDecodeError:
-                            logger.error("Failed to decode text message")
-                    
-                    elif opcode == WS_OPCODE_BINARY:
-                        # Binary message - print as hex
-                        hex_data = ' '.join('{:02x}'.format(ord(b) if isinstance(b, str) else b) for b in payload)
-                        print("Received binary stream: {0}".format(hex_data))
-                        logger.info("Binary stream: {0}".format(hex_data))
-                    
-                    elif opcode == WS_OPCODE_PING:
-                        # Respond to ping with pong
-                        self.send_pong(client_socket, payload)
-                    
-                    elif opcode == WS_OPCODE_PONG:
-                        # Pong received
-                        logger.info("Pong received")
-                    
-                    elif opcode == WS_OPCODE_CLOSE:
-                        # Close connection
-                        logger.info("Close frame received")
-                        break
-                    
-                    else:
-                        logger.warning("Unknown opcode received: {0}".format(opcode))
-                        
-                except socket.error as e:
-                    logger.info("Client connection closed: {0}".format(e))
-                    break
-                except Exception as e:
-                    logger.error("Error processing WebSocket frame: {0}".format(e))
+        
+        try:
+            # Parse every complete WebSocket frame in the buffer
+            while buf:
+                opcode, payload, consumed = parse_websocket_frame(buf)
+                if not consumed:
+                    # Incomplete frame, wait for more data
                     break
-                    
+                del buf[:consumed]
+                
+                if not self.handle_frame(state, opcode, payload):
+                    self.close_client(state)
+                    return
+                
         except Exception as e:
-            logger.error("Error in WebSocket client handling: {0}".format(e))
-        finally:
-            self.unregister_client(client_socket, client_address)
-            try:
-                client_socket.close()
-            except:
-                pass
+            logger.error("Error processing WebSocket frame: {0}".format(e))
+            self.close_client(state)
     
     def start_server(self):
         """Start WebSocket server"""
@@ -274,32 +380,49 @@ class WebSocketServer:
             # Bind and listen
             self.server_socket.bind((self.host, self.port))
             self.server_socket.listen(5)
+            self.server_socket.setblocking(False)
+            
+            # Single-threaded event loop: one selector watches the listening
+            # socket and every client socket
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(self.server_socket, selectors.EVENT_READ)
             
             self.running = True
             logger.info("WebSocket server started, listening on {0}:{1}".format(self.host, self.port))
             
-            # Accept connections
             while self.running:
-                try:
-                    client_socket, client_address = self.server_socket.accept()
-                    # Handle each client in a separate thread
-                    client_thread = threading.Thread(
-                        target=self.handle_client,
-                        args=(client_socket, client_address)
-                    )
-                    client_thread.daemon = True
-                    client_thread.start()
-                except socket.error as e:
-                    if self.running:
-                        logger.error("Error accepting connection: {0}".format(e))
-                    break
-                except Exception as e:
-                    logger.error("Error in server loop: {0}".format(e))
-                    break
+                for key, events in self.selector.select(timeout=SELECT_TIMEOUT):
+                    if key.fileobj is self.server_socket:
+                        # Accept connections
+                        try:
+                            self.accept_client()
+                        except BlockingIOError:
+                            continue
+                        except socket.error as e:
+                            if self.running:
+                                logger.error("Error accepting connection: {0}".format(e))
+                            self.running = False
+                            break
+                    else:
+                        state = self.client_states.get(key.fd)
+                        if state is None:
+                            continue
+                        # Socket buffer has room again: send queued frames
+                        if events & selectors.EVENT_WRITE and not self.flush_client(state):
+                            self.close_client(state)
+                            continue
+                        if events & selectors.EVENT_READ:
+                            self.handle_client(state)
             
         except Exception as e:
             logger.error("Error starting server: {0}".format(e))
             raise
+        finally:
+            for state in list(self.client_states.values()):
+                self.close_client(state)
+            if self.selector:
+                self.selector.close()
+                self.selector = None
     
     def stop_server(self):
         """Stop WebSocket server"""
@@ -5,61 +5,119 @@ import random
 import threading
 from datetime import datetime
 
+# Prefer orjson (C implementation) for serialization, fall back to json
+try:
+    import orjson
+
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode('utf-8')
+except ImportError:
+    json_dumps = json.dumps
+
+# 批量发送：缓冲区达到该大小或最早一条消息等待超过该时间时发送
+BATCH_MAX_BYTES = 4096
+BATCH_MAX_DELAY = 0.05  # 秒
+
+# 消息模板
+LOG_TEMPLATE = "LOG: %s - Event occurred with value %d"
+STATUS_TEMPLATE = "STATUS: System operational at %s"
+DATA_STREAM_TEMPLATE = "DATA_STREAM: %d,%d,%d"
+
+_now = datetime.now
+
 class SocketStreamClient:
     def __init__(self, host, port):
         self.host = host
         self.port = port
         self.socket = None
         self.running = False
+        # 实例私有的随机数生成器，避免模块级random的共享状态
+        self._rng = random.Random()
+        self._uniform = self._rng.uniform
+        self._randint = self._rng.randint
+        
+    def generate_sample_data(self, now=None):
+        """生成示例流数据（now为本批次共用的时间戳）"""
+        if now is None:
+            now = _now()
+        uniform = self._uniform
+        randint = self._randint
         
-    def generate_sample_data(self):
-        """生成示例流数据"""
-        data_types = [
+        kind = randint(0, 3)
+        if kind == 0:
             # JSON数据
-            lambda: json.dumps({
+            return json_dumps({
                 "type": "sensor_data",
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": now.isoformat(),
                 "data": {
-                    "temperature": round(random.uniform(20.0, 35.0), 2),
-                    "humidity": round(random.uniform(30.0, 80.0), 2),
-                    "pressure": round(random.uniform(980.0, 1020.0), 2)
+                    "temperature": round(uniform(20.0, 35.0), 2),
+                    "humidity": round(uniform(30.0, 80.0), 2),
+                    "pressure": round(uniform(980.0, 1020.0), 2)
                 }
-            }),
+            })
+        elif kind == 1:
             # 文本数据
-            lambda: "LOG: {0} - Event occurred with value {1}".format(datetime.now().strftime('%H:%M:%S'), random.randint(1, 100)),
+            return LOG_TEMPLATE % (now.strftime('%H:%M:%S'), randint(1, 100))
+        elif kind == 2:
             # 纯文本消息
-            lambda: "STATUS: System operational at {0}".format(datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+            return STATUS_TEMPLATE % now.strftime('%Y-%m-%d %H:%M:%S')
+        else:
             # 数值流
-            lambda: "DATA_STREAM: {0},{1},{2}".format(random.randint(100, 1000), random.randint(50, 200), random.randint(1, 10))
-        ]
-        
-        return random.choice(data_types)()
+            return DATA_STREAM_TEMPLATE % (randint(100, 1000), randint(50, 200), randint(1, 10))
     
     def send_stream_data(self):
         """持续发送流数据"""
         message_count = 0
+        out = bytearray()  # 待发送的批次
+        pending = []       # 本批次中的消息，发送成功后再打印
+        batch_start = 0.0
+        batch_time = None
         try:
             while self.running and self.socket:
-                # 生成数据
-                message = self.generate_sample_data()
+                if not out:
+                    batch_start = time.monotonic()
+                    batch_time = _now()
                 
-                # 发送数据
-                try:
-                    self.socket.sendall(message.encode('utf-8') + b'\n')  # 添加换行符
-                    message_count += 1
-                    print("Sent [{0}]: {1}".format(message_count, message))
-                except Exception as e:
-                    print("Failed to send message: {0}".format(e))
-                    break
+                # 生成数据
+                message = self.generate_sample_data(batch_time)
+                out.extend(message.encode('utf-8'))
+                out.extend(b'\n')  # 添加换行符
+                message_count += 1
+                pending.append((message_count, message))
                 
                 # 随机间隔发送
-                interval = random.uniform(0.5, 3.0)
+                interval = self._uniform(0.5, 3.0)
+                
+                # 批次已满，或等到下一条消息会超过最大延迟时发送整批数据
+                if len(out) >= BATCH_MAX_BYTES or time.monotonic() + interval - batch_start >= BATCH_MAX_DELAY:
+                    if not self.flush_batch(out, pending):
+                        break
+                
                 time.sleep(interval)
                 
         except Exception as e:
             print("Error in send stream: {0}".format(e))
         finally:
+            # 退出前发送尚未发出的批次
+            if out and self.socket:
+                self.flush_batch(out, pending)
             self.running = False
+    
+    def flush_batch(self, out, pending):
+        """发送整批数据，成功后清空批次并打印已发送的消息"""
+        try:
+            self.socket.sendall(out)
+        except Exception as e:
+            # 连接已不可用，丢弃本批次
+            print("Failed to send message: {0}".format(e))
+            out.clear()
+            del pending[:]
+            return False
+        out.clear()
+        for count, message in pending:
+            print("Sent [{0}]: {1}".format(count, message))
+        del pending[:]
+        return True
             
     def connect(self):
         """连接到服务器"""
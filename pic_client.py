@@ -8,21 +8,38 @@ import io
 PI_IP = "192.168.1.100"  # Replace with your Raspberry Pi actual IP
 PI_PORT = 5000
 URL = f"http://{PI_IP}:{PI_PORT}/video_feed"
+# Read size per chunk; iter_content() waits until a full chunk has
+# arrived, so keep it small enough that a frame is not held back
+CHUNK_SIZE = 4096
 
 def display_video_stream():
     """Display video stream"""
     stream = requests.get(URL, stream=True)
-    bytes_data = bytes()
+    buf = bytearray()
+    scan_from = 0  # Offset already searched for the JPEG end marker
     
     try:
-        for chunk in stream.iter_content(chunk_size=1024):
-            bytes_data += chunk
-            a = bytes_data.find(b'\xff\xd8')  # JPEG start
-            b = bytes_data.find(b'\xff\xd9')  # JPEG end
+        for chunk in stream.iter_content(chunk_size=CHUNK_SIZE):
+            buf.extend(chunk)
             
-            if a != -1 and b != -1:
-                jpg = bytes_data[a:b+2]
-                bytes_data = bytes_data[b+2:]
+            # A chunk may complete several frames; take all of them
+            while True:
+                a = buf.find(b'\xff\xd8')  # JPEG start
+                if a == -1:
+                    # No frame start yet, keep only a possibly split marker byte
+                    del buf[:-1]
+                    scan_from = 0
+                    break
+                b = buf.find(b'\xff\xd9', max(a + 2, scan_from))  # JPEG end
+                
+                if b == -1:
+                    # Resume from the last byte next time in case the marker is split
+                    scan_from = max(0, len(buf) - 1)
+                    break
+                
+                jpg = bytes(buf[a:b+2])
+                del buf[:b+2]
+                scan_from = 0
                 
                 # Convert bytes to image
                 image = Image.open(io.BytesIO(jpg))
@@ -34,7 +51,7 @@ def display_video_stream():
                 
                 # Press 'q' to quit
                 if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
+                    return
     except KeyboardInterrupt:
         pass
     finally:
@@ -3,56 +3,143 @@ import threading
 from flask import Flask, Response, render_template
 import time
 
+# libjpeg-turbo (SIMD) encoder when available, OpenCV otherwise
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    turbo_jpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    turbo_jpeg = None
+
 app = Flask(__name__)
 
+# Stream the camera's own MJPEG frames instead of decoding and re-encoding
+# them; set to False if the camera emits JPEGs that viewers cannot decode
+MJPEG_PASSTHROUGH = True
+
 # Global variables
 frame = None
-lock = threading.Lock()
+frame_is_jpeg = False           # True when frame holds the camera's MJPEG data
+frame_id = 0                    # Incremented for every captured frame
+frame_buf = -1                  # Index of the capture buffer holding frame
+buf_readers = [0, 0, 0]         # Readers still using each capture buffer
+cond = threading.Condition()    # Guards frame/frame_id, notified on new frame
 camera_running = False
 
+# Latest multipart stream part (boundary + JPEG), shared by all stream clients
+part_cache = {'id': -1, 'data': None}
+encode_lock = threading.Lock()
+
 def bgr8_to_jpeg(value, quality=75):
     """Convert BGR8 format image to JPEG format"""
+    if turbo_jpeg is not None:
+        return turbo_jpeg.encode(value, quality=quality, pixel_format=TJPF_BGR)
     return bytes(cv2.imencode('.jpg', value, [cv2.IMWRITE_JPEG_QUALITY, quality])[1])
 
+def is_jpeg_frame(img):
+    """Check that a raw capture is one row of bytes starting with the JPEG SOI marker"""
+    return (img.ndim == 2 and img.shape[0] == 1 and img.shape[1] > 2
+            and img[0, 0] == 0xFF and img[0, 1] == 0xD8)
+
 def camera_thread():
     """Camera capture thread"""
-    global frame, camera_running
+    global frame, frame_id, frame_buf, frame_is_jpeg, camera_running
     
-    # Open camera
-    cap = cv2.VideoCapture(0)
+    # Open camera; MJPEG passthrough needs the V4L2 backend, otherwise
+    # leave backend selection to OpenCV
+    if MJPEG_PASSTHROUGH:
+        cap = cv2.VideoCapture(0, cv2.CAP_V4L2)
+    else:
+        cap = cv2.VideoCapture(0)
     
     # Set camera parameters
     cap.set(3, 600)       # Width
     cap.set(4, 500)       # Height
     cap.set(5, 30)        # Frame rate
-    cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter.fourcc('M', 'J', 'P', 'G'))
+    mjpg = cv2.VideoWriter.fourcc('M', 'J', 'P', 'G')
+    cap.set(cv2.CAP_PROP_FOURCC, mjpg)
     cap.set(cv2.CAP_PROP_BRIGHTNESS, 64)   # Brightness
     cap.set(cv2.CAP_PROP_CONTRAST, 50)     # Contrast
     cap.set(cv2.CAP_PROP_EXPOSURE, 156)    # Exposure
+    # Only pass frames through when the driver really switched to MJPG;
+    # raw mode would otherwise hand back YUYV bytes in the same 1xN shape
+    passthrough = MJPEG_PASSTHROUGH and int(cap.get(cv2.CAP_PROP_FOURCC)) == mjpg
+    if passthrough:
+        # V4L2 raw mode: cap.read() returns the undecoded MJPEG buffer
+        cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+    elif MJPEG_PASSTHROUGH:
+        print("Camera did not accept MJPG, encoding frames instead")
     
     camera_running = True
     print("Camera thread started")
     
+    # Three capture buffers: the camera only fills one that is neither the
+    # published frame nor still being read by a stream client, so a frame
+    # is never overwritten while it is encoded.
+    bufs = [None, None, None]
+    
     while camera_running:
-        ret, img = cap.read()
+        with cond:
+            write_idx = next((i for i in range(len(bufs))
+                              if i != frame_buf and not buf_readers[i]), None)
+        if write_idx is None:
+            # Every buffer is busy; drop this frame instead of overwriting one
+            cap.grab()
+            time.sleep(0.033)
+            continue
+        
+        ret, img = cap.read(bufs[write_idx])
         if ret:
-            with lock:
-                frame = img.copy()
+            # cap.read() fills the buffer in place once its shape is known
+            bufs[write_idx] = img
+            if passthrough and not is_jpeg_frame(img):
+                # Not a JPEG; never stream it as image/jpeg
+                time.sleep(0.033)
+                continue
+            with cond:
+                frame = img
+                frame_buf = write_idx
+                frame_is_jpeg = passthrough
+                frame_id += 1
+                cond.notify_all()
         time.sleep(0.033)  # ~30fps
     
     cap.release()
     print("Camera thread stopped")
 
+def get_frame_part(snapshot_id, snapshot, is_jpeg):
+    """Return the multipart stream part for a frame, building it only once
+
+    If a newer frame has already been built, that part is returned instead.
+    """
+    with encode_lock:
+        if part_cache['id'] < snapshot_id:
+            jpeg_data = snapshot if is_jpeg else bgr8_to_jpeg(snapshot)
+            part_cache['data'] = b''.join((
+                b'--frame\r\n'
+                b'Content-Type: image/jpeg\r\n\r\n', jpeg_data, b'\r\n'))
+            part_cache['id'] = snapshot_id
+        return part_cache['data']
+
 def generate_frames():
     """Generate video stream frames"""
-    global frame
+    last_id = 0
     while True:
-        with lock:
-            if frame is not None:
-                jpeg_data = bgr8_to_jpeg(frame)
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + jpeg_data + b'\r\n')
-        time.sleep(0.033)
+        with cond:
+            if not cond.wait_for(lambda: frame_id != last_id, timeout=1.0):
+                continue
+            last_id = frame_id
+            snapshot = frame
+            snapshot_buf = frame_buf
+            is_jpeg = frame_is_jpeg
+            # Keep the camera from refilling this buffer until encoding is done
+            buf_readers[snapshot_buf] += 1
+        # Encode outside the condition so the camera thread is never blocked
+        try:
+            part = get_frame_part(last_id, snapshot, is_jpeg)
+        finally:
+            with cond:
+                buf_readers[snapshot_buf] -= 1
+        yield part
 
 @app.route('/')
 def index():
@@ -6,24 +6,83 @@ Implements basic WebSocket client functionality
 Python 2/3 compatible version
 """
 
+import os
 import socket
 import threading
 import hashlib
 import base64
 import struct
 import time
-import random
-import string
 import sys
 
+from ws_masking import mask_into
+
 # Python 2/3 compatibility
-if sys.version_info[0] == 3:
+PY3 = sys.version_info[0] == 3
+if PY3:
     unicode = str
     raw_input = input
+
+    def _encode_payload(message):
+        """Encode a text message to UTF-8 bytes"""
+        if not isinstance(message, str):
+            message = str(message)
+        return message.encode('utf-8')
 else:
     unicode = unicode
     raw_input = raw_input
 
+    def _encode_payload(message):
+        """Encode a text message to UTF-8 bytes (str is already bytes)"""
+        if isinstance(message, unicode):
+            return message.encode('utf-8')
+        return str(message)
+
+# Size of the reusable receive buffer
+RECV_BUFFER_SIZE = 65536
+
+# Kernel send/receive buffer size requested for the connection
+SOCKET_BUFFER_SIZE = 1 << 22
+
+# Largest handshake response read before the headers must be complete
+HANDSHAKE_MAX_SIZE = 4096
+
+# Largest payload accepted from the server; bounds the receive buffer
+MAX_FRAME_SIZE = 1 << 20
+
+# Header searched for in the lowercased handshake response
+ACCEPT_HEADER = '\r\nsec-websocket-accept:'
+
+# Non-urgent messages queued within this window share one frame (seconds)
+SEND_BATCH_INTERVAL = 0.005
+
+# Precompiled frame header formats
+_S_BB = struct.Struct('!BB')
+_S_BBH = struct.Struct('!BBH')
+_S_BBQ = struct.Struct('!BBQ')
+_S_H = struct.Struct('>H')
+_S_Q = struct.Struct('>Q')
+
+# Masking key for which XOR is a no-op
+ZERO_MASK = b'\x00\x00\x00\x00'
+
+def _header_length(payload_length):
+    """Frame header size without the mask: 2 bytes plus the extended payload length"""
+    if payload_length < 126:
+        return 2
+    if payload_length < 65536:
+        return 4
+    return 10
+
+def _pack_header(frame, first_byte, mask_bit, payload_length):
+    """Write the frame header (FIN/opcode byte, MASK bit and payload length) at the start of frame"""
+    if payload_length < 126:
+        _S_BB.pack_into(frame, 0, first_byte, mask_bit | payload_length)
+    elif payload_length < 65536:
+        _S_BBH.pack_into(frame, 0, first_byte, mask_bit | 126, payload_length)
+    else:
+        _S_BBQ.pack_into(frame, 0, first_byte, mask_bit | 127, payload_length)
+
 class SimpleWebSocketClient:
     def __init__(self, host='192.168.137.203', port=8081):
         self.host = host
@@ -31,11 +90,19 @@ class SimpleWebSocketClient:
         self.socket = None
         self.connected = False
         self.running = False
+        # Receive buffer reused by every recv_into() call
+        self._rbuf = bytearray(RECV_BUFFER_SIZE)
+        self._rview = memoryview(self._rbuf)
+        # Received bytes not yet decoded into complete frames
+        self._inbuf = bytearray()
+        # Batched outgoing messages; the lock also serializes socket writes
+        self._sendq = []
+        self._send_lock = threading.Lock()
+        self._flush_timer = None
         
     def generate_websocket_key(self):
         """Generate WebSocket handshake key"""
-        key_bytes = ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(16))
-        return base64.b64encode(key_bytes.encode('utf-8')).decode('utf-8')
+        return base64.b64encode(os.urandom(16)).decode('ascii')
     
     def create_handshake_request(self, websocket_key):
         """Create WebSocket handshake request"""
@@ -53,29 +120,34 @@ class SimpleWebSocketClient:
     def verify_handshake_response(self, response, websocket_key):
         """Verify WebSocket handshake response"""
         try:
-            lines = response.split('\r\n')
-            
             # Check status line
-            if not lines[0].startswith('HTTP/1.1 101'):
+            if not response.startswith('HTTP/1.1 101'):
                 print("Handshake failed: Invalid status code")
                 return False
             
-            # Find Accept header
+            # Expected Accept key
+            magic_string = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+            combined = websocket_key + magic_string
+            expected_accept = base64.b64encode(hashlib.sha1(combined.encode('ascii')).digest()).decode('ascii')
+            
+            # Fast path: the header line exactly as servers normally send it
+            if '\r\nSec-WebSocket-Accept: ' + expected_accept + '\r\n' in response:
+                return True
+            
+            # Otherwise find Accept header with one case-insensitive scan
             accept_key = None
-            for line in lines:
-                if line.startswith('Sec-WebSocket-Accept:'):
-                    accept_key = line.split(': ')[1]
-                    break
+            start = response.lower().find(ACCEPT_HEADER)
+            if start != -1:
+                start += len(ACCEPT_HEADER)
+                end = response.find('\r\n', start)
+                if end == -1:
+                    end = len(response)
+                accept_key = response[start:end].strip()
             
             if not accept_key:
                 print("Handshake failed: No Accept key found")
                 return False
             
-            # Verify Accept key
-            magic_string = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
-            combined = websocket_key + magic_string
-            expected_accept = base64.b64encode(hashlib.sha1(combined.encode('utf-8')).digest()).decode('utf-8')
-            
             if accept_key != expected_accept:
                 print("Handshake failed: Invalid Accept key")
                 return False
@@ -86,70 +158,65 @@ class SimpleWebSocketClient:
             print("Handshake verification error: {}".format(str(e)))
             return False
     
-    def create_frame(self, message, opcode=1):
-        """Create WebSocket frame"""
+    def create_frame(self, message, opcode=1, masked=True):
+        """Create WebSocket frame (unmasked frames are for the server-to-client direction)"""
         try:
-            if isinstance(message, unicode):
-                payload = message.encode('utf-8')
-            elif isinstance(message, str):
-                if sys.version_info[0] == 3:
-                    payload = message.encode('utf-8')
-                else:
-                    payload = message
+            if isinstance(message, (bytes, bytearray)):
+                payload = message
             else:
-                payload = str(message).encode('utf-8') if sys.version_info[0] == 3 else str(message)
-            
-            payload_length = len(payload)
+                payload = _encode_payload(message)
             
-            # First byte: FIN=1, opcode
-            first_byte = 0x80 | opcode
-            
-            # Generate mask
-            mask = struct.pack('!I', random.randint(0, 0xFFFFFFFF))
-            
-            # Create frame header
-            if payload_length < 126:
-                header = struct.pack('!BB', first_byte, 0x80 | payload_length)
-            elif payload_length < 65536:
-                header = struct.pack('!BBH', first_byte, 0x80 | 126, payload_length)
-            else:
-                header = struct.pack('!BBQ', first_byte, 0x80 | 127, payload_length)
-            
-            # Mask payload
-            masked_payload = bytearray()
-            for i in range(len(payload)):
-                if sys.version_info[0] == 3:
-                    payload_byte = payload[i] if isinstance(payload, (bytes, bytearray)) else ord(payload[i])
-                    mask_byte = mask[i % 4] if isinstance(mask, (bytes, bytearray)) else ord(mask[i % 4])
-                else:
-                    payload_byte = ord(payload[i]) if isinstance(payload[i], str) else payload[i]
-                    mask_byte = ord(mask[i % 4]) if isinstance(mask[i % 4], str) else mask[i % 4]
-                masked_payload.append(payload_byte ^ mask_byte)
-            
-            return header + mask + bytes(masked_payload)
+            if masked:
+                return self._create_frame_masked(payload, opcode)
+            return self._create_frame_unmasked(payload, opcode)
             
         except Exception as e:
             print("Frame creation error: {}".format(str(e)))
             return None
     
+    def _create_frame_masked(self, payload, opcode):
+        """Build a masked frame in one preallocated buffer"""
+        payload_length = len(payload)
+        
+        # Generate mask
+        mask = os.urandom(4)
+        
+        header_length = _header_length(payload_length)
+        payload_offset = header_length + 4
+        frame = bytearray(payload_offset + payload_length)
+        _pack_header(frame, 0x80 | opcode, 0x80, payload_length)
+        frame[header_length:payload_offset] = mask
+        
+        if mask == ZERO_MASK:
+            # XOR with an all-zero key is a no-op
+            frame[payload_offset:] = payload
+        else:
+            # Mask payload directly into the frame
+            mask_into(frame, payload_offset, payload, mask)
+        
+        return frame
+    
+    def _create_frame_unmasked(self, payload, opcode):
+        """Build an unmasked frame: MASK bit clear, no key, payload copied verbatim"""
+        payload_length = len(payload)
+        header_length = _header_length(payload_length)
+        frame = bytearray(header_length + payload_length)
+        _pack_header(frame, 0x80 | opcode, 0, payload_length)
+        frame[header_length:] = payload
+        return frame
+    
     def decode_frame(self, data):
         """Decode WebSocket frame"""
         if len(data) < 2:
             return None
         
-        # First byte
-        if sys.version_info[0] == 3:
-            first_byte = data[0] if isinstance(data, (bytes, bytearray)) else ord(data[0])
-        else:
-            first_byte = ord(data[0]) if isinstance(data[0], str) else data[0]
+        # First byte (data is a bytearray, indexing yields ints on 2 and 3)
+        first_byte = data[0]
         fin = (first_byte >> 7) & 1
         opcode = first_byte & 0x0f
         
         # Second byte
-        if sys.version_info[0] == 3:
-            second_byte = data[1] if isinstance(data, (bytes, bytearray)) else ord(data[1])
-        else:
-            second_byte = ord(data[1]) if isinstance(data[1], str) else data[1]
+        second_byte = data[1]
         masked = (second_byte >> 7) & 1
         payload_length = second_byte & 0x7f
         
@@ -158,26 +225,31 @@ class SimpleWebSocketClient:
         if payload_length == 126:
             if len(data) < 4:
                 return None
-            payload_length = struct.unpack('>H', data[2:4])[0]
+            payload_length = _S_H.unpack_from(data, 2)[0]
             header_length = 4
         elif payload_length == 127:
             if len(data) < 10:
                 return None
-            payload_length = struct.unpack('>Q', data[2:10])[0]
+            payload_length = _S_Q.unpack_from(data, 2)[0]
             header_length = 10
         
+        # Reject oversized frames before waiting to buffer their payload
+        if payload_length > MAX_FRAME_SIZE:
+            raise ValueError("Frame payload of {} bytes exceeds limit of {}".format(payload_length, MAX_FRAME_SIZE))
+        
         # Check data length
         if len(data) < header_length + payload_length:
             return None
         
-        # Extract payload
-        payload = data[header_length:header_length + payload_length]
+        # Extract payload (one copy out of the receive buffer)
+        payload = memoryview(data)[header_length:header_length + payload_length].tobytes()
         
         return {
             'fin': fin,
             'opcode': opcode,
             'payload': payload,
-            'payload_length': payload_length
+            'payload_length': payload_length,
+            'frame_length': header_length + payload_length
         }
     
     def connect(self):
@@ -187,6 +259,11 @@ class SimpleWebSocketClient:
             
             # Create socket
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # Send small frames immediately; larger buffers before connect()
+            # so the receive window is negotiated at the handshake
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
             self.socket.settimeout(10)
             self.socket.connect((self.host, self.port))
             
@@ -195,10 +272,22 @@ class SimpleWebSocketClient:
             handshake_request = self.create_handshake_request(websocket_key)
             
             print("Sending handshake request...")
-            self.socket.send(handshake_request.encode('utf-8'))
+            self.socket.sendall(handshake_request.encode('ascii'))
             
-            # Receive handshake response
-            response = self.socket.recv(1024).decode('utf-8')
+            # Receive handshake response up to the end of its headers
+            inbuf = self._inbuf
+            del inbuf[:]
+            end = -1
+            while end == -1 and len(inbuf) < HANDSHAKE_MAX_SIZE:
+                received = self.socket.recv_into(self._rview)
+                if not received:
+                    break
+                inbuf += self._rview[:received]
+                end = inbuf.find(b'\r\n\r\n')
+            end = end + 4 if end != -1 else len(inbuf)
+            response = bytes(inbuf[:end]).decode('ascii', 'replace')
+            # Frames sent right behind the response stay buffered for receive_messages()
+            del inbuf[:end]
             print("Received handshake response:")
             print(response)
             
@@ -219,19 +308,31 @@ class SimpleWebSocketClient:
                 self.socket.close()
             return False
     
-    def send_message(self, message):
-        """Send text message to server"""
+    def send_message(self, message, urgent=True):
+        """Send text message to server, non-urgent messages are batched"""
         if not self.connected:
             print("Not connected to server")
             return False
         
         try:
-            frame = self.create_frame(message, opcode=1)  # Text frame
-            if frame:
-                self.socket.send(frame)
-                print("Message sent: {}".format(message))
-                return True
-            else:
+            with self._send_lock:
+                if not urgent:
+                    # Queue the encoded message; the timer sends the whole batch as one frame
+                    if isinstance(message, (bytes, bytearray)):
+                        self._sendq.append(message)
+                    else:
+                        self._sendq.append(_encode_payload(message))
+                    if self._flush_timer is None:
+                        self._flush_timer = threading.Timer(SEND_BATCH_INTERVAL, self.flush_messages)
+                        self._flush_timer.daemon = True
+                        self._flush_timer.start()
+                    print("Message queued: {}".format(message))
+                    return True
+                
+                # Queued messages go out first to keep ordering
+                if self._flush_queue() and self._write_frame(message):
+                    print("Message sent: {}".format(message))
+                    return True
                 print("Failed to create message frame")
                 return False
                 
@@ -239,29 +340,79 @@ class SimpleWebSocketClient:
             print("Send message error: {}".format(str(e)))
             return False
     
+    def flush_messages(self):
+        """Send queued messages as one newline-delimited text frame"""
+        try:
+            with self._send_lock:
+                return self._flush_queue()
+        except Exception as e:
+            print("Send message error: {}".format(str(e)))
+            return False
+    
+    def _flush_queue(self):
+        """Send the queued batch, caller holds _send_lock"""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if not self._sendq:
+            return True
+        # Take the queue first so a failed send cannot leave it stuck
+        queued, self._sendq = self._sendq, []
+        return self._write_frame(b'\n'.join(queued))
+    
+    def _write_frame(self, message):
+        """Frame a text message (str or UTF-8 bytes) and write it to the socket, caller holds _send_lock"""
+        frame = self.create_frame(message, opcode=1)  # Text frame
+        if not frame:
+            return False
+        self.socket.sendall(frame)
+        return True
+    
+    def handle_frame(self, frame):
+        """Handle a decoded frame, return False when the connection should close"""
+        if frame['opcode'] == 1:  # Text frame
+            message = frame['payload'].decode('utf-8')
+            print("Received from server: {}".format(message))
+        elif frame['opcode'] == 2:  # Binary frame
+            print("Received binary data: {} bytes".format(len(frame['payload'])))
+        elif frame['opcode'] == 8:  # Close frame
+            print("Server requested connection close")
+            return False
+        elif frame['opcode'] == 9:  # Ping frame
+            print("Received Ping from server")
+        elif frame['opcode'] == 10:  # Pong frame
+            print("Received Pong from server")
+        return True
+    
     def receive_messages(self):
         """Receive messages from server (runs in separate thread)"""
+        # May already hold frames that arrived with the handshake response
+        inbuf = self._inbuf
+        # Bound once so the loop below only does local lookups
+        rview = self._rview
+        recv_into = self.socket.recv_into
+        decode_frame = self.decode_frame
+        handle_frame = self.handle_frame
         while self.running and self.connected:
             try:
-                data = self.socket.recv(1024)
-                if not data:
-                    print("Server closed connection")
+                # Handle every complete frame; a partial frame stays buffered
+                closing = False
+                while inbuf:
+                    frame = decode_frame(inbuf)
+                    if not frame:
+                        break
+                    del inbuf[:frame['frame_length']]
+                    if not handle_frame(frame):
+                        closing = True
+                        break
+                if closing:
                     break
                 
-                frame = self.decode_frame(data)
-                if frame:
-                    if frame['opcode'] == 1:  # Text frame
-                        message = frame['payload'].decode('utf-8')
-                        print("Received from server: {}".format(message))
-                    elif frame['opcode'] == 2:  # Binary frame
-                        print("Received binary data: {} bytes".format(len(frame['payload'])))
-                    elif frame['opcode'] == 8:  # Close frame
-                        print("Server requested connection close")
-                        break
-                    elif frame['opcode'] == 9:  # Ping frame
-                        print("Received Ping from server")
-                    elif frame['opcode'] == 10:  # Pong frame
-                        print("Received Pong from server")
+                received = recv_into(rview)
+                if not received:
+                    print("Server closed connection")
+                    break
+                inbuf += rview[:received]
                 
             except socket.timeout:
                 continue
@@ -279,10 +430,13 @@ class SimpleWebSocketClient:
         
         if self.socket:
             try:
+                # Send queued messages
+                self.flush_messages()
+                
                 # Send close frame
                 close_frame = self.create_frame("", opcode=8)
                 if close_frame:
-                    self.socket.send(close_frame)
+                    self.socket.sendall(close_frame)
                 self.socket.close()
             except:
                 pass
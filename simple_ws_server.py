@@ -6,42 +6,103 @@ Implements message receiving and printing to terminal
 Python 2.7 compatible version
 """
 
+import errno
 import socket
-import threading
 import hashlib
 import base64
 import struct
 import time
 
+from ws_masking import mask_payload, unmask_text
+
+try:
+    import selectors
+except ImportError:
+    # Python 2: backport from PyPI
+    import selectors2 as selectors
+
+try:
+    from functools import lru_cache
+except ImportError:
+    # Python 2: no lru_cache, compute the accept key every time
+    def lru_cache(maxsize=128):
+        return lambda func: func
+
+# Size of the receive buffer shared by all connections
+RECV_BUFFER_SIZE = 65536
+
+# Largest HTTP upgrade request accepted before the headers must be complete
+HANDSHAKE_MAX_SIZE = 4096
+
+# Largest payload accepted from a client; bounds the per-client buffer
+MAX_FRAME_SIZE = 1 << 20
+
+# Selector wait timeout in seconds, bounds how long stop_server() takes to be noticed
+SELECT_TIMEOUT = 1.0
+
+# Precompiled extended payload length formats
+_S_H = struct.Struct('>H')
+_S_Q = struct.Struct('>Q')
+
+# Kernel send/receive buffer size requested for each connection
+SOCKET_BUFFER_SIZE = 1 << 22
+
+# Header searched for in the lowercased handshake request
+KEY_HEADER = '\r\nsec-websocket-key:'
+
+# errno values of a non-blocking call that has nothing to do yet
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK)
+
+def _would_block(error):
+    """True for a socket error that only means "try again later"
+
+    Python 2 has no BlockingIOError, so check the errno instead.
+    """
+    return isinstance(error, socket.timeout) or getattr(error, 'errno', None) in _WOULD_BLOCK
+
+MAGIC_STRING = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+@lru_cache(maxsize=1024)
+def compute_accept_key(websocket_key):
+    """Compute the Sec-WebSocket-Accept value, cached per unique key"""
+    combined = websocket_key + MAGIC_STRING
+    sha1_hash = hashlib.sha1(combined.encode('ascii')).digest()
+    return base64.b64encode(sha1_hash).decode('ascii')
+
 class SimpleWebSocketServer:
     def __init__(self, host='0.0.0.0', port=8081):
         self.host = host
         self.port = port
         self.server_socket = None
         self.running = False
-        self.clients = []
+        self.selector = None
+        # fd -> per-client state (socket, address, handshake flag, unconsumed bytes)
+        self.client_states = {}
+        # Receive buffer reused for every recv_into(); the event loop runs
+        # in one thread, so all connections share it
+        self._rbuf = bytearray(RECV_BUFFER_SIZE)
+        self._rview = memoryview(self._rbuf)
         
     def generate_accept_key(self, websocket_key):
         """Generate WebSocket handshake response Accept key"""
-        magic_string = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
-        combined = websocket_key + magic_string
-        sha1_hash = hashlib.sha1(combined.encode('utf-8')).digest()
-        return base64.b64encode(sha1_hash).decode('utf-8')
+        return compute_accept_key(websocket_key)
     
-    def perform_handshake(self, client_socket):
-        """Perform WebSocket handshake"""
+    def perform_handshake(self, client_socket, request):
+        """Perform WebSocket handshake for the buffered HTTP request"""
         try:
-            request = client_socket.recv(1024).decode('utf-8')
+            request = request.decode('ascii', 'replace')
             print("Received handshake request:")
             print(request)
             
-            # Parse WebSocket Key
-            lines = request.split('\r\n')
+            # Parse WebSocket Key with one case-insensitive scan
             websocket_key = None
-            for line in lines:
-                if line.startswith('Sec-WebSocket-Key:'):
-                    websocket_key = line.split(': ')[1]
-                    break
+            start = request.lower().find(KEY_HEADER)
+            if start != -1:
+                start += len(KEY_HEADER)
+                end = request.find('\r\n', start)
+                if end == -1:
+                    end = len(request)
+                websocket_key = request[start:end].strip()
             
             if not websocket_key:
                 print("WebSocket Key not found")
@@ -57,7 +118,7 @@ class SimpleWebSocketServer:
                 "\r\n"
             ).format(accept_key)
             
-            client_socket.send(response.encode('utf-8'))
+            client_socket.sendall(response.encode('ascii'))
             print("Handshake completed successfully")
             return True
             
@@ -70,13 +131,13 @@ class SimpleWebSocketServer:
         if len(data) < 2:
             return None
         
-        # First byte
-        first_byte = ord(data[0]) if isinstance(data[0], str) else data[0]
+        # First byte (data is a bytearray, indexing yields ints on 2 and 3)
+        first_byte = data[0]
         fin = (first_byte >> 7) & 1
         opcode = first_byte & 0x0f
         
         # Second byte
-        second_byte = ord(data[1]) if isinstance(data[1], str) else data[1]
+        second_byte = data[1]
         masked = (second_byte >> 7) & 1
         payload_length = second_byte & 0x7f
         
@@ -85,101 +146,177 @@ class SimpleWebSocketServer:
         if payload_length == 126:
             if len(data) < 4:
                 return None
-            payload_length = struct.unpack('>H', data[2:4])[0]
+            payload_length = _S_H.unpack_from(data, 2)[0]
             header_length = 4
         elif payload_length == 127:
             if len(data) < 10:
                 return None
-            payload_length = struct.unpack('>Q', data[2:10])[0]
+            payload_length = _S_Q.unpack_from(data, 2)[0]
             header_length = 10
         
+        # Reject oversized frames before waiting to buffer their payload
+        if payload_length > MAX_FRAME_SIZE:
+            raise ValueError("Frame payload of {} bytes exceeds limit of {}".format(payload_length, MAX_FRAME_SIZE))
+        
         # Mask
         if masked:
             if len(data) < header_length + 4:
                 return None
-            mask = data[header_length:header_length + 4]
+            mask = memoryview(data)[header_length:header_length + 4].tobytes()
             header_length += 4
         
         # Check data length
         if len(data) < header_length + payload_length:
             return None
         
-        # Extract payload
-        payload = data[header_length:header_length + payload_length]
+        # Extract payload (one copy out of the receive buffer)
+        payload = memoryview(data)[header_length:header_length + payload_length].tobytes()
         
-        # Unmask
+        # Unmask; text frames are decoded in the same pass when possible
+        text = None
         if masked:
-            decoded_payload = bytearray()
-            for i in range(len(payload)):
-                mask_byte = ord(mask[i % 4]) if isinstance(mask[i % 4], str) else mask[i % 4]
-                payload_byte = ord(payload[i]) if isinstance(payload[i], str) else payload[i]
-                decoded_payload.append(payload_byte ^ mask_byte)
-            payload = bytes(decoded_payload)
+            if opcode == 1 and unmask_text is not None:
+                payload, text = unmask_text(mask, payload)
+            else:
+                payload = mask_payload(payload, mask)
         
         return {
             'fin': fin,
             'opcode': opcode,
             'payload': payload,
-            'payload_length': payload_length
+            'text': text,
+            'payload_length': payload_length,
+            'frame_length': header_length + payload_length
         }
     
-    def handle_client(self, client_socket, client_address):
-        """Handle client connection"""
+    def handle_frame(self, frame, client_address):
+        """Handle a decoded frame, return False when the client asked to close"""
+        if frame['opcode'] == 1:  # Text frame
+            message = frame['text']
+            if message is None:
+                message = frame['payload'].decode('utf-8')
+            print("Received message from {}: {}".format(client_address, message))
+        elif frame['opcode'] == 2:  # Binary frame
+            print("Received binary message from {}: {} bytes".format(client_address, len(frame['payload'])))
+        elif frame['opcode'] == 8:  # Close frame
+            print("Client {} requested connection close".format(client_address))
+            return False
+        elif frame['opcode'] == 9:  # Ping frame
+            print("Received Ping from {}".format(client_address))
+        elif frame['opcode'] == 10:  # Pong frame
+            print("Received Pong from {}".format(client_address))
+        return True
+    
+    def accept_client(self):
+        """Accept a new client and register it with the selector"""
+        client_socket, client_address = self.server_socket.accept()
         print("New client connected: {}".format(client_address))
+        # Disable Nagle so small frames are not delayed
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        client_socket.setblocking(False)
+        fd = client_socket.fileno()
+        self.client_states[fd] = {
+            'fd': fd,
+            'socket': client_socket,
+            'address': client_address,
+            'handshake_done': False,
+            # Unconsumed bytes: the HTTP request, then partial WebSocket frames
+            'inbuf': bytearray(),
+        }
+        self.selector.register(client_socket, selectors.EVENT_READ)
+    
+    def close_client(self, state):
+        """Remove client from the selector and close its socket"""
+        client_socket = state['socket']
+        self.client_states.pop(state['fd'], None)
+        try:
+            self.selector.unregister(client_socket)
+        except (KeyError, ValueError):
+            pass
+        try:
+            client_socket.close()
+        except:
+            pass
+        print("Client {} disconnected".format(state['address']))
+    
+    def handle_client(self, state):
+        """Handle readable client connection"""
+        client_socket = state['socket']
+        client_address = state['address']
         
         try:
-            # Perform handshake
-            if not self.perform_handshake(client_socket):
-                client_socket.close()
+            received = client_socket.recv_into(self._rview)
+        except socket.error as e:
+            if _would_block(e):
                 return
+            print("Client {} connection error: {}".format(client_address, str(e)))
+            self.close_client(state)
+            return
+        except Exception as e:
+            print("Client {} connection error: {}".format(client_address, str(e)))
+            self.close_client(state)
+            return
+        
+        if not received:
+            self.close_client(state)
+            return
+        
+        inbuf = state['inbuf']
+        inbuf += self._rview[:received]
+        
+        if not state['handshake_done']:
+            # Collect the HTTP request until the end of its headers
+            end = inbuf.find(b'\r\n\r\n')
+            if end == -1:
+                if len(inbuf) < HANDSHAKE_MAX_SIZE:
+                    return
+                end = len(inbuf)
+            else:
+                end += 4
             
-            self.clients.append(client_socket)
+            # Perform handshake
+            if not self.perform_handshake(client_socket, bytes(inbuf[:end])):
+                self.close_client(state)
+                return
             
-            # Message receiving loop
-            while self.running:
-                try:
-                    data = client_socket.recv(1024)
-                    if not data:
-                        break
-                    
-                    # Decode WebSocket frame
-                    frame = self.decode_frame(data)
-                    if frame:
-                        if frame['opcode'] == 1:  # Text frame
-                            message = frame['payload'].decode('utf-8')
-                            print("Received message from {}: {}".format(client_address, message))
-                        elif frame['opcode'] == 2:  # Binary frame
-                            print("Received binary message from {}: {} bytes".format(client_address, len(frame['payload'])))
-                        elif frame['opcode'] == 8:  # Close frame
-                            print("Client {} requested connection close".format(client_address))
-                            break
-                        elif frame['opcode'] == 9:  # Ping frame
-                            print("Received Ping from {}".format(client_address))
-                        elif frame['opcode'] == 10:  # Pong frame
-                            print("Received Pong from {}".format(client_address))
-                    
-                except socket.timeout:
-                    continue
-                except Exception as e:
-                    print("Error processing message from client {}: {}".format(client_address, str(e)))
+            # Frames sent right behind the request stay in the buffer
+            del inbuf[:end]
+            state['handshake_done'] = True
+        
+        try:
+            # Decode every complete WebSocket frame; a partial frame stays buffered
+            decode_frame = self.decode_frame
+            handle_frame = self.handle_frame
+            while inbuf:
+                frame = decode_frame(inbuf)
+                if not frame:
                     break
+                del inbuf[:frame['frame_length']]
+                if not handle_frame(frame, client_address):
+                    self.close_client(state)
+                    return
         
         except Exception as e:
-            print("Client {} connection error: {}".format(client_address, str(e)))
-        
-        finally:
-            if client_socket in self.clients:
-                self.clients.remove(client_socket)
-            client_socket.close()
-            print("Client {} disconnected".format(client_address))
+            print("Error processing message from client {}: {}".format(client_address, str(e)))
+            self.close_client(state)
     
     def start_server(self):
         """Start server"""
         try:
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            # Accepted sockets inherit the receive buffer, sized before the handshake
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
             self.server_socket.bind((self.host, self.port))
             self.server_socket.listen(5)
+            self.server_socket.setblocking(False)
+            
+            # Single-threaded event loop: one selector watches the listening
+            # socket and every client socket
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(self.server_socket, selectors.EVENT_READ)
             self.running = True
             
             print("WebSocket server started successfully")
@@ -187,24 +324,30 @@ class SimpleWebSocketServer:
             print("Waiting for client connections...")
             
             while self.running:
-                try:
-                    client_socket, client_address = self.server_socket.accept()
-                    client_thread = threading.Thread(
-                        target=self.handle_client,
-                        args=(client_socket, client_address)
-                    )
-                    client_thread.daemon = True
-                    client_thread.start()
-                except socket.error as e:
-                    if self.running:
-                        print("Error accepting connection: {}".format(str(e)))
-                    break
+                for key, _ in self.selector.select(timeout=SELECT_TIMEOUT):
+                    if key.fileobj is self.server_socket:
+                        try:
+                            self.accept_client()
+                        except socket.error as e:
+                            if _would_block(e):
+                                continue
+                            if self.running:
+                                print("Error accepting connection: {}".format(str(e)))
+                            self.running = False
+                            break
+                    else:
+                        state = self.client_states.get(key.fd)
+                        if state is not None:
+                            self.handle_client(state)
         
         except Exception as e:
             print("Error starting server: {}".format(str(e)))
         
         finally:
             self.stop_server()
+            if self.selector:
+                self.selector.close()
+                self.selector = None
     
     def stop_server(self):
         """Stop server"""
@@ -212,12 +355,12 @@ class SimpleWebSocketServer:
         self.running = False
         
         # Close all client connections
-        for client in self.clients[:]:
+        for state in list(self.client_states.values()):
             try:
-                client.close()
+                state['socket'].close()
             except:
                 pass
-        self.clients.clear()
+        self.client_states.clear()
         
         # Close server socket
         if self.server_socket:
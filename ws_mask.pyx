@@ -0,0 +1,122 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+WebSocket payload masking
+Compiled backend for ws_masking.py (used when tornado.speedups is not
+installed, and for the in-place and text variants). Build in place with:
+
+    cythonize -i ws_mask.pyx
+"""
+
+from libc.string cimport memcpy
+from cpython.bytes cimport PyBytes_FromStringAndSize, PyBytes_AS_STRING
+
+
+def websocket_mask(bytes mask, bytes data):
+    """XOR data with the 4-byte mask (same signature as tornado.speedups.websocket_mask)"""
+    if len(mask) != 4:
+        raise ValueError("mask must contain 4 bytes")
+
+    cdef Py_ssize_t data_length = len(data)
+    cdef Py_ssize_t words = data_length // 8
+    cdef Py_ssize_t i
+    cdef const unsigned char* src = <const unsigned char*><const char*>data
+    cdef const unsigned char* key = <const unsigned char*><const char*>mask
+    cdef bytes result = PyBytes_FromStringAndSize(NULL, data_length)
+    cdef unsigned char* dst = <unsigned char*>PyBytes_AS_STRING(result)
+    cdef unsigned int mask32
+    cdef unsigned long long mask64
+    cdef unsigned long long word
+
+    # Repeat the mask into a 64-bit word; memcpy keeps the byte order native
+    memcpy(&mask32, key, 4)
+    mask64 = (<unsigned long long>mask32 << 32) | mask32
+
+    for i in range(words):
+        memcpy(&word, src + i * 8, 8)
+        word ^= mask64
+        memcpy(dst + i * 8, &word, 8)
+
+    # Tail shorter than one word
+    for i in range(words * 8, data_length):
+        dst[i] = src[i] ^ key[i & 3]
+
+    return result
+
+
+cdef extern from "Python.h":
+    object PyUnicode_New(Py_ssize_t size, Py_UCS4 maxchar)
+    void* PyUnicode_DATA(object o)
+
+
+def websocket_unmask_text(bytes mask, bytes data):
+    """Unmask a text payload and decode it in the same pass, return (bytes, str)
+
+    Bytes are OR-ed together while unmasking; when no high bit is set the
+    payload is pure ASCII and is copied into a str without a separate
+    UTF-8 validation pass. Otherwise it is decoded as UTF-8.
+    """
+    if len(mask) != 4:
+        raise ValueError("mask must contain 4 bytes")
+
+    cdef Py_ssize_t data_length = len(data)
+    cdef Py_ssize_t words = data_length // 8
+    cdef Py_ssize_t i
+    cdef const unsigned char* src = <const unsigned char*><const char*>data
+    cdef const unsigned char* key = <const unsigned char*><const char*>mask
+    cdef bytes result = PyBytes_FromStringAndSize(NULL, data_length)
+    cdef unsigned char* dst = <unsigned char*>PyBytes_AS_STRING(result)
+    cdef unsigned int mask32
+    cdef unsigned long long mask64
+    cdef unsigned long long word
+    cdef unsigned long long seen = 0
+
+    memcpy(&mask32, key, 4)
+    mask64 = (<unsigned long long>mask32 << 32) | mask32
+
+    for i in range(words):
+        memcpy(&word, src + i * 8, 8)
+        word ^= mask64
+        seen |= word
+        memcpy(dst + i * 8, &word, 8)
+
+    for i in range(words * 8, data_length):
+        dst[i] = src[i] ^ key[i & 3]
+        seen |= dst[i]
+
+    if seen & 0x8080808080808080ULL:
+        return result, result.decode('utf-8')
+
+    # Pure ASCII: fill a compact 1-byte str directly
+    text = PyUnicode_New(data_length, 127)
+    memcpy(PyUnicode_DATA(text), dst, data_length)
+    return result, text
+
+
+def websocket_mask_into(bytearray out, Py_ssize_t offset, bytes mask, bytes data):
+    """XOR data with the 4-byte mask, writing the result into out[offset:]"""
+    if len(mask) != 4:
+        raise ValueError("mask must contain 4 bytes")
+
+    cdef Py_ssize_t data_length = len(data)
+    if offset < 0 or offset + data_length > len(out):
+        raise ValueError("output buffer too small")
+
+    cdef Py_ssize_t words = data_length // 8
+    cdef Py_ssize_t i
+    cdef const unsigned char* src = <const unsigned char*><const char*>data
+    cdef const unsigned char* key = <const unsigned char*><const char*>mask
+    cdef unsigned char* dst = <unsigned char*><char*>out + offset
+    cdef unsigned int mask32
+    cdef unsigned long long mask64
+    cdef unsigned long long word
+
+    memcpy(&mask32, key, 4)
+    mask64 = (<unsigned long long>mask32 << 32) | mask32
+
+    for i in range(words):
+        memcpy(&word, src + i * 8, 8)
+        word ^= mask64
+        memcpy(dst + i * 8, &word, 8)
+
+    for i in range(words * 8, data_length):
+        dst[i] = src[i] ^ key[i & 3]
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+WebSocket payload masking
+Shared by the WebSocket servers and client; picks the fastest available
+backend: wsaccel, compiled routine, NumPy, whole-payload integer XOR, byte loop
+"""
+
+# Compiled masking routine: Tornado's C speedup, else the bundled Cython
+# module (build with `cythonize -i ws_mask.pyx`)
+try:
+    from tornado.speedups import websocket_mask as _websocket_mask
+except ImportError:
+    try:
+        from ws_mask import websocket_mask as _websocket_mask
+    except ImportError:
+        _websocket_mask = None
+
+# wsaccel's C XOR masker, used ahead of the other backends when installed
+try:
+    from wsaccel.xormask import XorMaskerSimple
+except ImportError:
+    XorMaskerSimple = None
+
+# Cython-only variants: masking straight into an output buffer, and
+# unmask + text decode in one pass (ASCII payloads skip UTF-8 validation)
+try:
+    from ws_mask import websocket_mask_into as _websocket_mask_into
+    from ws_mask import websocket_unmask_text as unmask_text
+except ImportError:
+    _websocket_mask_into = None
+    unmask_text = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Payloads shorter than this are masked in pure Python; NumPy's per-call
+# setup cost outweighs the vectorized XOR below this size
+NUMPY_MASK_THRESHOLD = 64
+
+# int.from_bytes/to_bytes (Python 3) allow XORing the payload as one integer
+INT_FROM_BYTES = hasattr(int, 'from_bytes')
+
+def mask_payload(payload, mask):
+    """Mask (or unmask) payload with the 4-byte WebSocket masking key"""
+    if XorMaskerSimple is not None:
+        return XorMaskerSimple(bytes(mask)).process(bytes(payload))
+    if _websocket_mask is not None:
+        return _websocket_mask(bytes(mask), bytes(payload))
+    if np is not None and len(payload) >= NUMPY_MASK_THRESHOLD:
+        p = np.frombuffer(payload, dtype=np.uint8)
+        m = np.frombuffer(mask, dtype=np.uint8)
+        return (p ^ np.resize(m, p.shape)).tobytes()
+    if INT_FROM_BYTES:
+        # XOR the whole payload as one little-endian integer against the
+        # mask repeated to the same length; CPython does this in C
+        payload_length = len(payload)
+        key = (bytes(mask) * ((payload_length >> 2) + 1))[:payload_length]
+        masked = int.from_bytes(payload, 'little') ^ int.from_bytes(key, 'little')
+        return masked.to_bytes(payload_length, 'little')
+    # Python 2: byte-wise loop, four bytes per pass so each uses a fixed
+    # mask byte; the tail (< 4 bytes) indexes the mask with i & 3
+    mask = tuple(bytearray(mask))
+    mask0, mask1, mask2, mask3 = mask
+    data = bytearray(payload)
+    payload_length = len(data)
+    tail = payload_length & ~3
+    for i in range(0, tail, 4):
+        data[i] ^= mask0
+        data[i + 1] ^= mask1
+        data[i + 2] ^= mask2
+        data[i + 3] ^= mask3
+    for i in range(tail, payload_length):
+        data[i] ^= mask[i & 3]
+    return bytes(data)
+
+def mask_into(out, offset, payload, mask):
+    """Mask payload into the bytearray out starting at offset, without an intermediate copy"""
+    if _websocket_mask_into is not None:
+        _websocket_mask_into(out, offset, bytes(mask), bytes(payload))
+        return
+    payload_length = len(payload)
+    if _websocket_mask is None and np is not None and payload_length >= NUMPY_MASK_THRESHOLD:
+        p = np.frombuffer(payload, dtype=np.uint8)
+        m = np.frombuffer(mask, dtype=np.uint8)
+        dst = np.frombuffer(out, dtype=np.uint8, count=payload_length, offset=offset)
+        np.bitwise_xor(p, np.resize(m, p.shape), out=dst)
+        return
+    out[offset:offset + payload_length] = mask_payload(payload, mask)